@@ -1,33 +1,71 @@
-import copy
+import ast
+import functools
+import os
+import pickle
 from pathlib import Path
 
 import gradio as gr
-import torch
 import yaml
-from transformers import is_torch_xpu_available
-import json
 from modules import shared
 import modules.extensions as extensions
-with open(Path(__file__).resolve().parent / '../css/NotoSans/stylesheet.css', 'r') as f:
-    css = f.read()
-with open(Path(__file__).resolve().parent / '../css/main.css', 'r') as f:
-    css += f.read()
-with open(Path(__file__).resolve().parent / '../css/katex/katex.min.css', 'r') as f:
-    css += f.read()
-with open(Path(__file__).resolve().parent / '../css/highlightjs/highlightjs-copy.min.css', 'r') as f:
-    css += f.read()
-with open(Path(__file__).resolve().parent / '../js/main.js', 'r') as f:
-    js = f.read()
-with open(Path(__file__).resolve().parent / '../js/save_files.js', 'r') as f:
-    save_files_js = f.read()
-with open(Path(__file__).resolve().parent / '../js/switch_tabs.js', 'r') as f:
-    switch_tabs_js = f.read()
-with open(Path(__file__).resolve().parent / '../js/show_controls.js', 'r') as f:
-    show_controls_js = f.read()
-with open(Path(__file__).resolve().parent / '../js/update_big_picture.js', 'r') as f:
-    update_big_picture_js = f.read()
-with open(Path(__file__).resolve().parent / '../js/dark_theme.js', 'r') as f:
-    dark_theme_js = f.read()
+
+_ASSET_CACHE = Path(__file__).resolve().parent / '../.ui_assets.cache'
+_CSS_FILES = (
+    'css/NotoSans/stylesheet.css',
+    'css/main.css',
+    'css/katex/katex.min.css',
+    'css/highlightjs/highlightjs-copy.min.css',
+)
+_JS_FILES = (
+    'js/main.js',
+    'js/save_files.js',
+    'js/switch_tabs.js',
+    'js/show_controls.js',
+    'js/update_big_picture.js',
+    'js/dark_theme.js',
+)
+
+
+def _read_asset(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, os.fstat(fd).st_size).decode('utf-8')
+    finally:
+        os.close(fd)
+
+
+def _load_assets():
+    """
+    Loads the UI stylesheets and scripts, reusing a pickled bundle
+    when none of the source files changed since it was written.
+    """
+    base = str(Path(__file__).resolve().parent / '..')
+    paths = [os.path.join(base, name) for name in _CSS_FILES + _JS_FILES]
+    fingerprint = []
+    for path in paths:
+        st = os.stat(path)
+        fingerprint.append((path, st.st_mtime_ns, st.st_size))
+
+    try:
+        with open(_ASSET_CACHE, 'rb') as f:
+            cached_fingerprint, assets = pickle.load(f)
+        if cached_fingerprint == fingerprint:
+            return assets
+    except Exception:
+        pass
+
+    contents = [_read_asset(path) for path in paths]
+    assets = (''.join(contents[:len(_CSS_FILES)]),) + tuple(contents[len(_CSS_FILES):])
+    try:
+        with open(_ASSET_CACHE, 'wb') as f:
+            pickle.dump((fingerprint, assets), f)
+    except OSError:
+        pass
+
+    return assets
+
+
+css, js, save_files_js, switch_tabs_js, show_controls_js, update_big_picture_js, dark_theme_js = _load_assets()
 
 refresh_symbol = '🔄'
 delete_symbol = '🗑️'
@@ -99,6 +137,7 @@ else:
     audio_notification_js = ""
 
 
+@functools.lru_cache(maxsize=None)
 def list_model_elements():
     elements = [
         'loader',
@@ -127,6 +166,9 @@ def list_model_elements():
         'hqq_backend'
     ]
 
+    import torch
+    from transformers import is_torch_xpu_available
+
     if is_torch_xpu_available():
         for i in range(torch.xpu.device_count()):
             elements.append(f'gpu_memory_{i}')
@@ -134,9 +176,10 @@ def list_model_elements():
         for i in range(torch.cuda.device_count()):
             elements.append(f'gpu_memory_{i}')
 
-    return elements
+    return tuple(elements)
 
 
+@functools.lru_cache(maxsize=None)
 def list_interface_input_elements():
     elements = [
         'max_new_tokens',
@@ -210,7 +253,7 @@ def list_interface_input_elements():
     ]
 
     elements += list_model_elements()
-    return elements
+    return tuple(elements)
 
 def toggle_tokenize(state):
     if "tokenize" not in state:
@@ -223,18 +266,11 @@ def toggle_tokenize(state):
 
 
 def gather_interface_values(*args):
-    interface_elements = list_interface_input_elements()
-    output = {}
-
-    for element, value in zip(interface_elements, args):
-        if element == "history":
-            if "root" in value:
-                value = value.split("root=")[1]
-                value = value.replace("'", '"')
-                value = json.loads(value)
-
+    output = dict(zip(list_interface_input_elements(), args))
 
-        output[element] = value 
+    history = output.get("history")
+    if isinstance(history, str) and "root=" in history:
+        output["history"] = ast.literal_eval(history.split("root=", 1)[1])
 
     if "tokenize" not in output:
         output["tokenize"] = False
@@ -258,7 +294,7 @@ def apply_interface_values(state, use_persistent=False):
 
 
 def save_settings(state, preset, extensions_list, show_controls, theme_state):
-    output = copy.deepcopy(shared.settings)
+    output = dict(shared.settings)
     exclude = ['name2', 'greeting', 'context', 'truncation_length', 'instruction_template_str']
     for k in state:
         if k in shared.settings and k not in exclude:
@@ -287,9 +323,8 @@ def save_settings(state, preset, extensions_list, show_controls, theme_state):
                         output[_id] = params[param]
 
     # Do not save unchanged settings
-    for key in list(output.keys()):
-        if key in shared.default_settings and output[key] == shared.default_settings[key]:
-            output.pop(key)
+    defaults = shared.default_settings
+    output = {k: v for k, v in output.items() if not (k in defaults and v == defaults[k])}
 
     return yaml.dump(output, sort_keys=False, width=float("inf"), allow_unicode=True)
 
@@ -301,12 +336,13 @@ def create_refresh_button(refresh_component, refresh_method, refreshed_args, ele
     def refresh():
         refresh_method()
         args = refreshed_args() if callable(refreshed_args) else refreshed_args
+        args = {k: tuple(v) if isinstance(v, list) else v for k, v in (args or {}).items()}
 
-        return gr.update(**(args or {}))
+        return gr.update(**args)
 
     refresh_button = gr.Button(refresh_symbol, elem_classes=elem_class, interactive=interactive,visible=False)
     refresh_button.click(
-        fn=lambda: {k: tuple(v) if type(k) is list else v for k, v in refresh().items()},
+        fn=refresh,
         inputs=[],
         outputs=[refresh_component]
     )
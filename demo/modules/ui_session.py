@@ -72,7 +72,7 @@ def get_boolean_arguments(active=False):
     exclude = shared.deprecated_args
 
     cmd_list = vars(shared.args)
-    bool_list = sorted([k for k in cmd_list if type(cmd_list[k]) is bool and k not in exclude + ui.list_model_elements()])
+    bool_list = sorted([k for k in cmd_list if type(cmd_list[k]) is bool and k not in exclude and k not in ui.list_model_elements()])
     bool_active = [k for k in bool_list if vars(shared.args)[k]]
 
     if active:
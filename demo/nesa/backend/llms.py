@@ -1,18 +1,13 @@
 import asyncio
-import html
 import os
-import re
-import unicodedata
+import time
 import uuid
 import warnings
-import nats
-from typing import Any, Generator, List, Optional
-import ast
+from typing import Any, Dict, Generator, List, Optional, Union
 import httpx
 import msgspec
-from nats.js import api as js_api
-from nesa.backend.utils import sanitize_subject_token, desanitize_subject_token
-from nesa.backend.protocol import InferenceResponse, LLMInference, Message, Role, SessionID
+from nesa.backend.utils import clean_string
+from nesa.backend.protocol import LLMInference, Message, Role, SessionID
 from nesa.backend.registry import ModelRegistry
 from nesa.settings import settings
 from transformers import AutoTokenizer
@@ -21,156 +16,160 @@ response_topic: str = "inference-results"
 request_topic: str = "inference-requests"
 model_mappings = {"nesaorg_Llama-3.1-8B-Instruct-Encrypted": "meta-llama/Llama-3.1-8B-Instruct-ee"}
 
-async def async_yield_text(text):
-    for item in text:
-        yield item
-        await asyncio.sleep(0.1)
+
+class _TinyDelta(msgspec.Struct, forbid_unknown_fields=False):
+    content: Optional[Union[int, str]] = None
+
+
+class _TinyChoice(msgspec.Struct, forbid_unknown_fields=False):
+    delta: _TinyDelta
+    finish_reason: Optional[str] = None
 
 
-def clean_string(message):
+class _TinyResp(msgspec.Struct, forbid_unknown_fields=False):
     """
-    cleans HTML-encoded characters and unwanted characters from a string.
+    the subset of InferenceResponse read while streaming.
     """
-    decoded_content = html.unescape(message)
-    printable_content = re.sub(r"[^ -~]", "", decoded_content)
-    normalized_content = unicodedata.normalize("NFKC", printable_content)
-    cleaned_content = normalized_content.strip()
+    choices: List[_TinyChoice]
 
-    return cleaned_content
 
+_DECODER = msgspec.json.Decoder(_TinyResp)
+_LLM_ENCODER = msgspec.json.Encoder()
+# shared across requests so consecutive messages reuse the open connection.
+_HTTP = httpx.Client(
+    timeout=httpx.Timeout(None, connect=10),
+    limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=120),
+)
 
-async def sse_message_handler(inf_request: LLMInference, timeout=60):
+async def async_yield_text(text):
+    for item in text:
+        yield item
+        await asyncio.sleep(0.1)
+
+
+def sse_message_handler(inf_request: LLMInference, timeout=60):
     headers = {
         "Accept": "text/event-stream",
         "Content-Type": "application/json",
     }
 
 
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
-            "POST", settings.stream_url, data=msgspec.json.encode(inf_request), headers=headers, timeout=None
-        ) as response:
-            response.raise_for_status()
-
-            buffer = ""
-            start_time = asyncio.get_event_loop().time()
-            first_message_received = False
-            async for chunk in response.aiter_text(chunk_size=1024): 
-                buffer += chunk
-                await asyncio.sleep(0.0)
-                while "\n\n" in buffer:
-                    event_block, buffer = buffer.split("\n\n", 1)
-
-                    lines = event_block.splitlines()
-                    sse_event = {}
-                    for line in lines:
-                        if line.startswith("event:"):
-                            sse_event["event"] = line[len("event:") :].strip()
-                        elif line.startswith("data:"):
-                            sse_event["data"] = line[len("data:") :].strip()
-
-                    if "data" in sse_event:
-                        try:
-                            inf_response = msgspec.json.decode(
-                                sse_event["data"].encode("utf-8"), type=InferenceResponse
-                            )
-
-                            first_message_received = True
-
-                            if inf_response.choices[0].finish_reason:
-                                yield inf_response.choices[0].delta.content
-                                return
+    with _HTTP.stream(
+        "POST", settings.stream_url, content=_LLM_ENCODER.encode(inf_request), headers=headers
+    ) as response:
+        response.raise_for_status()
+
+        buffer = bytearray()
+        start_time = time.monotonic()
+        first_message_received = False
+        for chunk in response.iter_bytes():
+            buffer += chunk
+            while (end := buffer.find(b"\n\n")) >= 0:
+                event_block = bytes(buffer[:end])
+                del buffer[: end + 2]
 
+                lines = event_block.splitlines()
+                sse_event = {}
+                for line in lines:
+                    if line.startswith(b"event:"):
+                        sse_event["event"] = line[len(b"event:") :].strip()
+                    elif line.startswith(b"data:"):
+                        sse_event["data"] = line[len(b"data:") :].strip()
+
+                if "data" in sse_event:
+                    try:
+                        inf_response = _DECODER.decode(sse_event["data"])
+
+                        first_message_received = True
+
+                        if inf_response.choices[0].finish_reason:
                             yield inf_response.choices[0].delta.content
+                            return
+
+                        yield inf_response.choices[0].delta.content
 
-                        except msgspec.DecodeError:
-                            print("Could not decode SSE data as InferenceResponse")
+                    except msgspec.DecodeError:
+                        print("Could not decode SSE data as InferenceResponse")
 
-                if not first_message_received and (asyncio.get_event_loop().time() - start_time) > timeout:
-                    yield None
-                    return
+            if not first_message_received and (time.monotonic() - start_time) > timeout:
+                yield None
+                return
 
 
 def generate_prompt_template(
     current_msg: str, system_prompt: Optional[str], history: Optional[str], lookback=10, use_memory=True
 ):
-    current_msg = [{"role": Role.USER.value, "content": clean_string(current_msg)}]
-    system_instructions = [{"role": Role.SYSTEM.value, "content": clean_string(system_prompt)}]  # noqa
-    history = history[-lookback:]
-    messages = []
-
-    if use_memory:
-        for i, msg_pair in enumerate(history):
-            user_msg, assistant_msg = msg_pair
-            user_msg = {"role": Role.USER.value, "content": clean_string(user_msg)}
-            messages.append(user_msg)
-            assistant_msg =assistant_msg.split("[file]", 1)[0]
-            assistant_msg = {"role": Role.ASSISTANT.value, "content": clean_string(assistant_msg)}
-            messages.append(assistant_msg)
-
-    history = system_instructions + messages + current_msg
-    
-    return history
+    history = (history or [])[-lookback:] if use_memory else []
+    messages = [None] * (2 * len(history) + 2)
+    messages[0] = {"role": Role.SYSTEM.value, "content": clean_string(system_prompt) if system_prompt else ""}  # noqa
+
+    for i, (user_msg, assistant_msg) in enumerate(history):
+        assistant_msg = assistant_msg.split("[file]", 1)[0] if assistant_msg else ""
+        messages[1 + 2 * i] = {"role": Role.USER.value, "content": clean_string(user_msg) if user_msg else ""}
+        messages[2 + 2 * i] = {"role": Role.ASSISTANT.value, "content": clean_string(assistant_msg) if assistant_msg else ""}
+
+    messages[-1] = {"role": Role.USER.value, "content": clean_string(current_msg) if current_msg else ""}
+
+    return messages
 
 
 def process_stream_sync(inf_request, tokenizer):
     """
-    Converts the async streaming handler into a synchronous generator.
+    Decodes the streamed tokens into text chunks.
     """
     terminators = [
                 tokenizer.eos_token_id,  # noqa: // todo:  need a mechanism to forward to backend
                 tokenizer.convert_tokens_to_ids("<|eot_id|>"),
             ]
-    async def async_wrapper():
-        print("[Client]")
-        print("Output received from server:")
-        out_tokens = []
-        async for content in sse_message_handler(inf_request):    
-            if content:
-                if isinstance(content,int):
-                    out_tokens.append(content)
-                yield content
-
-        print(out_tokens)
-        print()
-
-    def sync_generator():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            gen = async_wrapper()
-            while True:
-                content = loop.run_until_complete(gen.__anext__())
-                if content is None:
-                    raise StopAsyncIteration
-                if isinstance(content,str):
-                    yield f"""[file]{content}[file]"""
-                else:
-                    if content not in terminators:         
-                        yield tokenizer.decode(content)
-        except StopAsyncIteration:
-            return
-        finally:
-            loop.close()
-    return sync_generator()
+    print("[Client]")
+    print("Output received from server:")
+    out_tokens = []
+    ids = []
+    # only ids[prefix_offset:] are decoded per token; ids[prefix_offset:read_offset]
+    # were already emitted and are kept as context so word boundaries decode correctly.
+    prefix_offset = read_offset = 0
+    for content in sse_message_handler(inf_request):
+        if not content:
+            continue
+        if isinstance(content, str):
+            yield f"""[file]{content}[file]"""
+        else:
+            out_tokens.append(content)
+            if content not in terminators:
+                ids.append(content)
+                prefix_text = tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+                new_text = tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)
+                # hold back partial multi-byte characters until the next token completes them
+                if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+                    yield new_text[len(prefix_text):]
+                    prefix_offset, read_offset = read_offset, len(ids)
+
+    if read_offset < len(ids):
+        prefix_text = tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+        new_text = tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text):
+            yield new_text[len(prefix_text):]
+
+    print(out_tokens)
+    print()
 
 
 @ModelRegistry.register("nesaorg_Llama-3.1-8B-Instruct-Encrypted", is_model_specific=True)
 class DistributedLLM:
+    _TOKENIZER_CACHE: Dict[str, Any] = {}
+
     def __init__(self, **kwargs):
         warnings.warn("Instantiation is deprecated.", DeprecationWarning)
 
     @classmethod
     def load_model_tokenizer(cls, model_name, **kwargs):
         model = None
+        if model_name in cls._TOKENIZER_CACHE:
+            return cls._TOKENIZER_CACHE[model_name], model
+
         tokenizer_dir = os.path.join("models", model_name)
         tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
-        if "llama" in model_name:
-            terminators = [
-                tokenizer.eos_token_id,  # noqa: // todo:  need a mechanism to forward to backend
-                tokenizer.convert_tokens_to_ids("<|eot_id|>"),
-            ]
+        cls._TOKENIZER_CACHE[model_name] = tokenizer
         return tokenizer, model  # avoid loading the model locally for llms.
 
     @classmethod
@@ -192,6 +191,8 @@ class DistributedLLM:
         
         input_ids = tokenizer.apply_chat_template(prompt_template, add_generation_prompt=True)
         print(input_ids[-20:])
+        # the encrypted backend expects the token ids serialized into Message.content;
+        # decoding to text would make it re-tokenize with the wrong vocabulary.
         inf_request = LLMInference(
             stream=True,
             model=model_mappings[model_name],
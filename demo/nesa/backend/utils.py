@@ -1,3 +1,7 @@
+import html
+import unicodedata
+from functools import lru_cache
+
 mapped_chars = {
     ".": "#a#",
     ">": "#b#",
@@ -12,4 +16,20 @@ def sanitize_subject_token(s):
 def desanitize_subject_token(s):
     for k, v in mapped_chars.items():
         s = s.replace(v, k)
-    return s
\ No newline at end of file
+    return s
+
+
+# ASCII control characters, dropped along with anything outside the ASCII range.
+_CONTROL_CHARS = dict.fromkeys([*range(32), 127])
+
+
+# prior turns are re-sent with every message of a conversation, so keep
+# their cleaned form around instead of re-cleaning the whole history.
+@lru_cache(maxsize=1024)
+def clean_string(message):
+    """
+    cleans HTML-encoded characters and unwanted characters from a string.
+    """
+    normalized_content = unicodedata.normalize("NFKC", html.unescape(message))
+    printable_content = normalized_content.encode("ascii", "ignore").decode("ascii").translate(_CONTROL_CHARS)
+    return printable_content.strip()